@@ -1,96 +1,244 @@
 # android_code_ai/ast_parser.py
 import os
-import json
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from tree_sitter_languages import get_parser
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .dependency_graph import file_hasher
 from .di_analyzer import DIAnalyzer
 from .xml_analyzer import XMLAnalyzer
-import hashlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
 
 logger = logging.getLogger("AndroidCodeAI")
 
+@lru_cache(maxsize=None)
+def _find_lang_root(source_dir: str) -> Optional[str]:
+    """Find the nearest enclosing java/kotlin source root of a directory"""
+    path = Path(source_dir)
+    for candidate in (path, *path.parents):
+        if candidate.name in ('java', 'kotlin'):
+            return str(candidate)
+    return None
+
+@lru_cache(maxsize=65536)
+def _import_to_file_cached(import_path: str, lang_root: str) -> Optional[str]:
+    """Resolve an import to a Kotlin or Java source file under a source root"""
+    package_path = os.path.join(lang_root, import_path.replace('.', '/'))
+    for ext in ('.kt', '.java'):
+        if os.path.exists(package_path + ext):
+            return package_path + ext
+    return None
+
+class _DependencyRecorder:
+    """Stands in for DependencyGraph in worker processes, recording edges to return"""
+    def __init__(self):
+        self.edges = []
+    
+    def add_dependency(self, source: str, target: str, rel_type: str = "imports"):
+        self.edges.append((source, target, rel_type))
+
+# Per-process parser used by extract_chunks_batch workers
+_worker_parser = None
+
+def _init_worker():
+    """Create one ASTParser per worker process"""
+    global _worker_parser
+    _worker_parser = ASTParser(_DependencyRecorder())
+
+def _extract_chunks_worker(file_path: str) -> Tuple[List[Dict], List[Tuple[str, str, str]], str, Optional[Tuple[int, int]]]:
+    """Extract chunks in a worker, returning them with the import edges, content hash and stat"""
+    recorder = _worker_parser.dep_graph
+    recorder.edges = []
+    try:
+        # Read and hash once; the hash keys the cache and the caller's change tracking.
+        # The stat comes from the same descriptor so it describes exactly these bytes
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            code_bytes = f.read()
+        file_stat = (st.st_mtime_ns, st.st_size)
+        file_hash = file_hasher(code_bytes).hexdigest()
+        chunks = _worker_parser.extract_chunks(file_path, code_bytes, file_hash)
+    except Exception as e:
+        logger.error(f"Error extracting chunks from {file_path}: {str(e)}")
+        chunks = []
+        file_hash = ""
+        file_stat = None
+    return chunks, recorder.edges, file_hash, file_stat
+
 class ASTParser:
     MAX_CHUNK_SIZE = 2000
     MIN_CHUNK_SIZE = 500
     CACHE_DIR = ".ast_cache"
+    # Bump whenever chunking output changes so stale cache entries are ignored
+    PARSER_VERSION = 3
+    WORKER_CHUNKSIZE = 16  # Files sent to a chunking worker per task
+    CHUNK_NODE_TYPES = {
+        'class_declaration': 'class',
+        'function_declaration': 'function',
+        'method_declaration': 'function',
+    }
     
     def __init__(self, dep_graph):
         os.makedirs(self.CACHE_DIR, exist_ok=True)
-        self.parsers = {
+        # One directory scan up front instead of an exists() syscall per file
+        self._cached = {entry.name for entry in os.scandir(self.CACHE_DIR)}
+        kotlin_parser = get_parser('kotlin')
+        self._parsers_by_ext = MappingProxyType({
             'python': get_parser('python'),
             'java': get_parser('java'),
-            'kt': get_parser('kotlin'),
-            'kts': get_parser('kotlin'),
-        }
+            'kt': kotlin_parser,
+            'kts': kotlin_parser,
+        })
+        self._chunkers_by_ext = MappingProxyType({
+            'java': self._chunk_code,
+            'kt': self._chunk_code,
+            'kts': self._chunk_code,
+            'xml': self._chunk_xml,
+        })
+        self._max_workers = os.cpu_count() or 1
+        # Files a pool can have handed out when it breaks: a chunk per worker plus
+        # the one the executor queues ahead
+        self.max_in_flight = self.WORKER_CHUNKSIZE * (self._max_workers + 1)
         self.di_analyzer = DIAnalyzer()
         self.xml_analyzer = XMLAnalyzer()
         self.dep_graph = dep_graph
     
     def get_parser(self, file_path: str):
         """Get appropriate parser for file type"""
-        ext = Path(file_path).suffix[1:]
-        return self.parsers.get(ext)
+        ext = file_path.rpartition('.')[2]
+        return self._parsers_by_ext.get(ext)
     
-    def parse_file(self, file_path: str) -> Any:
+    def parse_file(self, file_path: str, code_bytes: Optional[bytes] = None) -> Any:
         """Parse file using Tree-sitter if possible"""
         parser = self.get_parser(file_path)
         if not parser:
             return None
             
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                code = f.read()
-            return parser.parse(bytes(code, 'utf8'))
+            if code_bytes is None:
+                with open(file_path, 'rb') as f:
+                    code_bytes = f.read()
+            return parser.parse(code_bytes)
         except Exception as e:
             logger.error(f"Error parsing {file_path}: {str(e)}")
             return None
     
-    def extract_chunks(self, file_path: str) -> List[Dict]:
-        """Extract or load chunks for a file"""
-        cache_file = self._get_cache_path(file_path)
+    def extract_chunks(self, file_path: str, code_bytes: Optional[bytes] = None,
+                       file_hash: Optional[str] = None) -> List[Dict]:
+        """Extract or load chunks for a file, reusing its bytes and hash if already known"""
+        if code_bytes is None:
+            try:
+                with open(file_path, 'rb') as f:
+                    code_bytes = f.read()
+            except Exception as e:
+                logger.error(f"Error reading {file_path}: {str(e)}")
+                return []
+        if file_hash is None:
+            file_hash = file_hasher(code_bytes).hexdigest()
+        
+        cache_name = self._get_cache_name(file_hash, file_path)
+        cache_file = os.path.join(self.CACHE_DIR, cache_name)
         
         # Try to load from cache
-        if os.path.exists(cache_file):
+        if cache_name in self._cached:
             try:
-                with open(cache_file, 'r') as f:
-                    return json.load(f)
+                with open(cache_file, 'rb') as f:
+                    chunks = self._load_chunks(f.read())
+                # Identical files share a cache entry, so point chunks at this path
+                for chunk in chunks:
+                    chunk['file_path'] = file_path
+                return chunks
             except:
                 logger.warning(f"Failed to load cache for {file_path}")
         
         # Generate chunks and save to cache
-        chunks = self._generate_chunks(file_path)
-        with open(cache_file, 'w') as f:
-            json.dump(chunks, f, indent=2)
+        chunks = self._generate_chunks(file_path, code_bytes)
+        self._write_cache(cache_file, chunks)
+        self._cached.add(cache_name)
         
         return chunks
     
-    def _get_cache_path(self, file_path: str) -> str:
-        """Get path to cache file"""
-        file_hash = hashlib.md5(file_path.encode()).hexdigest()
-        return os.path.join(self.CACHE_DIR, f"{file_hash}.json")
+    def extract_chunks_batch(self, file_paths: List[str]) -> Iterator[Tuple[str, List[Dict], str, Optional[Tuple[int, int]]]]:
+        """Extract chunks for many files in parallel, yielding (file_path, chunks, file_hash, file_stat) in order"""
+        # Start workers from a clean interpreter: forking a parent that already holds the
+        # encoder (and possibly CUDA) and Chroma's threads can deadlock the children
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(
+            max_workers=self._max_workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker
+        ) as executor:
+            results = executor.map(_extract_chunks_worker, file_paths, chunksize=self.WORKER_CHUNKSIZE)
+            for file_path, (chunks, edges, file_hash, file_stat) in zip(file_paths, results):
+                # The dependency graph lives in this process, so edges are merged here
+                for source, target, rel_type in edges:
+                    self.dep_graph.add_dependency(source, target, rel_type)
+                yield file_path, chunks, file_hash, file_stat
+    
+    def _load_chunks(self, data: bytes) -> List[Dict]:
+        """Deserialize cached chunks, preferring orjson when installed"""
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+    
+    def _dump_chunks(self, chunks: List[Dict]) -> bytes:
+        """Serialize chunks for the cache, preferring orjson when installed"""
+        if orjson is not None:
+            return orjson.dumps(chunks)
+        return json.dumps(chunks, separators=(',', ':')).encode('utf-8')
     
-    def _generate_chunks(self, file_path: str) -> List[Dict]:
+    def _write_cache(self, cache_file: str, chunks: List[Dict]):
+        """Write chunks to a per-process temp file, then atomically move it into place"""
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(self._dump_chunks(chunks))
+        os.replace(tmp_file, cache_file)
+    
+    def _get_cache_name(self, file_hash: str, file_path: str) -> str:
+        """Get cache file name, keyed by file content hash, chunker dispatch and parser version"""
+        # Identical bytes chunk differently per extension, and manifests differ from other XML
+        ext = os.path.splitext(file_path)[1].lstrip('.')
+        manifest = '-manifest' if file_path.endswith('AndroidManifest.xml') else ''
+        return f"{file_hash[:24]}-{ext}{manifest}-{self.PARSER_VERSION}.json"
+    
+    def _generate_chunks(self, file_path: str, code_bytes: bytes) -> List[Dict]:
         """Generate chunks for a file"""
-        content = ""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except Exception as e:
+            content = code_bytes.decode('utf-8')
+        except UnicodeDecodeError as e:
             logger.error(f"Error reading {file_path}: {str(e)}")
             return []
         
         # Process based on file type
-        if file_path.endswith(('.java', '.kt', '.kts')):
-            tree = self.parse_file(file_path)
-            return self._extract_code_chunks(tree, content, file_path)
-        elif file_path.endswith('.xml'):
-            return self.xml_analyzer.analyze_file(file_path, content)
-        else:
-            return self._chunk_by_lines(content, file_path)
+        ext = file_path.rpartition('.')[2]
+        chunker = self._chunkers_by_ext.get(ext, self._chunk_text)
+        return chunker(code_bytes, content, file_path)
+    
+    def _chunk_code(self, code_bytes: bytes, content: str, file_path: str) -> List[Dict]:
+        """Chunk Java/Kotlin sources via their AST"""
+        tree = self.parse_file(file_path, code_bytes)
+        return self._extract_code_chunks(tree, code_bytes, content, file_path)
+    
+    def _chunk_xml(self, code_bytes: bytes, content: str, file_path: str) -> List[Dict]:
+        """Chunk XML resources via the XML analyzer"""
+        return self.xml_analyzer.analyze_file(file_path, content, code_bytes)
+    
+    def _chunk_text(self, code_bytes: bytes, content: str, file_path: str) -> List[Dict]:
+        """Chunk any other file type by lines"""
+        chunks = []
+        self._chunk_by_lines(code_bytes, 0, len(code_bytes), file_path, 'text_chunk', chunks)
+        return chunks
     
-    def _extract_code_chunks(self, tree: Any, content: str, file_path: str) -> List[Dict]:
+    def _extract_code_chunks(self, tree: Any, code_bytes: bytes, content: str, file_path: str) -> List[Dict]:
         """Extract chunks from code files"""
         chunks = []
         
@@ -100,109 +248,65 @@ class ASTParser:
         # Perform DI analysis
         di_analysis = self.di_analyzer.analyze_file(file_path, content)
         
-        # Extract imports for dependency graph
-        imports = self._extract_imports(tree)
+        # Extract classes, functions and imports in a single pass
+        imports = []
+        self._walk_code(tree, code_bytes, file_path, chunks, imports)
+        
+        # Record imports in the dependency graph
         for imp in imports:
             target_file = self._import_to_file(imp, file_path)
             if target_file:
                 self.dep_graph.add_dependency(file_path, target_file, "imports")
         
-        # Extract classes and functions as primary chunks
-        cursor = tree.walk()
-        self._traverse_code(cursor.node, content, file_path, chunks)
-        
         # Add DI chunks if available
         if di_analysis:
             chunks.extend(self._create_di_chunks(di_analysis, file_path))
         
         return chunks
     
-    def _extract_imports(self, tree: Any) -> list:
-        """Extract import statements from code"""
-        imports = []
-        cursor = tree.walk()
-        
-        def traverse(node):
-            if node.type == 'import_declaration':
-                import_statement = node.text.decode('utf8').replace('import', '').strip().rstrip(';')
-                imports.append(import_statement)
-            
-            for child in node.children:
-                traverse(child)
-        
-        traverse(cursor.node)
-        return imports
-    
     def _import_to_file(self, import_path: str, source_file: str) -> Optional[str]:
         """Convert import path to file path"""
-        try:
-            project_root = Path(source_file).parent
-            while project_root.name != 'java' and project_root.name != 'kotlin':
-                project_root = project_root.parent
-            
-            package_path = import_path.replace('.', '/')
-            return str(project_root / f"{package_path}.kt")
-        except:
+        lang_root = _find_lang_root(os.path.dirname(source_file))
+        if lang_root is None:
             return None
+        return _import_to_file_cached(import_path, lang_root)
     
-    def _traverse_code(self, node: Any, content: str, file_path: str, chunks: list):
-        """Traverse AST to extract meaningful chunks"""
+    def _walk_code(self, tree: Any, code_bytes: bytes, file_path: str, chunks: list, imports: list):
+        """Walk the AST depth-first with a TreeCursor, collecting chunks and imports"""
+        cursor = tree.walk()
         try:
-            # Chunk classes
-            if node.type == 'class_declaration':
-                class_content = node.text.decode('utf8')
-                if self.MIN_CHUNK_SIZE < len(class_content) < self.MAX_CHUNK_SIZE:
-                    chunks.append({
-                        'type': 'class',
-                        'content': class_content,
-                        'file_path': file_path,
-                    })
-                else:
-                    self._chunk_large_node(node, content, file_path, chunks, 'class')
-            
-            # Chunk functions
-            elif node.type in ['function_declaration', 'method_declaration']:
-                func_content = node.text.decode('utf8')
-                if self.MIN_CHUNK_SIZE < len(func_content) < self.MAX_CHUNK_SIZE:
-                    chunks.append({
-                        'type': 'function',
-                        'content': func_content,
-                        'file_path': file_path,
-                    })
-                else:
-                    self._chunk_large_node(node, content, file_path, chunks, 'function')
-            
-            # Recursively traverse children
-            for child in node.children:
-                self._traverse_code(child, content, file_path, chunks)
+            while True:
+                node = cursor.node
+                node_type = node.type
+                
+                # Chunk classes and functions
+                chunk_type = self.CHUNK_NODE_TYPES.get(node_type)
+                if chunk_type:
+                    start, end = node.start_byte, node.end_byte
+                    if self.MIN_CHUNK_SIZE < end - start < self.MAX_CHUNK_SIZE:
+                        chunks.append({
+                            'type': chunk_type,
+                            'file_path': file_path,
+                            'start': start,
+                            'end': end,
+                        })
+                    else:
+                        self._chunk_by_lines(code_bytes, start, end, file_path, f'{chunk_type}_chunk', chunks)
+                
+                # Collect imports
+                elif node_type == 'import_declaration':
+                    import_statement = code_bytes[node.start_byte:node.end_byte].decode('utf8')
+                    imports.append(import_statement.replace('import', '').strip().rstrip(';'))
                 
+                # Descend first, then move to the next sibling of the nearest ancestor
+                if cursor.goto_first_child():
+                    continue
+                while not cursor.goto_next_sibling():
+                    if not cursor.goto_parent():
+                        return
         except Exception as e:
             logger.error(f"Error traversing node: {str(e)}")
     
-    def _chunk_large_node(self, node: Any, content: str, file_path: str, chunks: list, node_type: str):
-        """Break large AST nodes into smaller chunks"""
-        node_content = node.text.decode('utf8')
-        current_chunk = ""
-        
-        # Split by logical boundaries
-        lines = node_content.split('\n')
-        for line in lines:
-            if len(current_chunk) + len(line) > self.MAX_CHUNK_SIZE and current_chunk:
-                chunks.append({
-                    'type': f'{node_type}_chunk',
-                    'content': current_chunk.strip(),
-                    'file_path': file_path,
-                })
-                current_chunk = ""
-            current_chunk += line + '\n'
-        
-        if current_chunk.strip():
-            chunks.append({
-                'type': f'{node_type}_chunk',
-                'content': current_chunk.strip(),
-                'file_path': file_path,
-            })
-    
     def _create_di_chunks(self, di_analysis: Dict, file_path: str) -> list:
         """Create chunks for DI components"""
         chunks = []
@@ -236,27 +340,38 @@ class ASTParser:
         
         return chunks
     
-    def _chunk_by_lines(self, content: str, file_path: str) -> list:
-        """Chunk content by lines for unsupported file types"""
-        chunks = []
-        lines = content.split('\n')
-        current_chunk = ""
-        
-        for line in lines:
-            if len(current_chunk) + len(line) > self.MAX_CHUNK_SIZE and current_chunk:
-                chunks.append({
-                    'type': 'text_chunk',
-                    'content': current_chunk.strip(),
-                    'file_path': file_path,
-                })
-                current_chunk = ""
-            current_chunk += line + '\n'
+    def _chunk_by_lines(self, code_bytes: bytes, start: int, end: int, file_path: str,
+                        chunk_type: str, chunks: list):
+        """Split a byte range into line-aligned chunks of at most MAX_CHUNK_SIZE"""
+        chunk_start = start
+        chunk_len = 0
+        line_start = start
         
-        if current_chunk.strip():
-            chunks.append({
-                'type': 'text_chunk',
-                'content': current_chunk.strip(),
-                'file_path': file_path,
-            })
+        while True:
+            newline = code_bytes.find(b'\n', line_start, end)
+            line_end = end if newline == -1 else newline
+            if chunk_len + (line_end - line_start) > self.MAX_CHUNK_SIZE and chunk_len:
+                self._add_span_chunk(code_bytes, chunk_start, line_start, file_path, chunk_type, chunks)
+                chunk_start = line_start
+                chunk_len = 0
+            chunk_len += line_end - line_start + 1
+            if newline == -1:
+                break
+            line_start = newline + 1
         
-        return chunks
\ No newline at end of file
+        self._add_span_chunk(code_bytes, chunk_start, end, file_path, chunk_type, chunks)
+    
+    def _add_span_chunk(self, code_bytes: bytes, start: int, end: int, file_path: str,
+                        chunk_type: str, chunks: list):
+        """Add a chunk for a byte range, trimmed of surrounding whitespace"""
+        span = code_bytes[start:end]
+        stripped = span.strip()
+        if not stripped:
+            return
+        start += len(span) - len(span.lstrip())
+        chunks.append({
+            'type': chunk_type,
+            'file_path': file_path,
+            'start': start,
+            'end': start + len(stripped),
+        })
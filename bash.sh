@@ -1,5 +1,5 @@
 # Install dependencies
-pip install tree-sitter-languages chromadb sentence-transformers openai networkx rank-bm25
+pip install tree-sitter-languages chromadb "sentence-transformers[onnx]" openai transformers torch bitsandbytes accelerate rank-bm25 orjson blake3 pyahocorasick
 
 # Full index
 python main.py /path/to/android/project --index
@@ -1,6 +1,12 @@
 # android_code_ai/context_retrieval.py
+import re
 from typing import Dict, List
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 class ContextRetrievalEngine:
     """Automatically finds relevant context for queries"""
     def __init__(self, vector_db):
@@ -42,15 +48,39 @@ class QueryAnalyzer:
             'logic': ['function', 'method', 'class', 'logic', 'algorithm', 'calculate'],
             'data': ['database', 'room', 'api', 'network', 'retrofit', 'data source']
         }
+        self._automaton = self._build_automaton()
+        # Fallback when pyahocorasick is missing: one compiled alternation per type
+        self._patterns = [
+            (qtype, re.compile('|'.join(map(re.escape, keywords))))
+            for qtype, keywords in self.query_types.items()
+        ]
+    
+    def _build_automaton(self):
+        """Build an Aho-Corasick automaton over all keywords, if available"""
+        if ahocorasick is None:
+            return None
+        
+        automaton = ahocorasick.Automaton()
+        # Tag each keyword with its query type's priority so dict order still wins
+        for priority, (qtype, keywords) in enumerate(self.query_types.items()):
+            for keyword in keywords:
+                if keyword not in automaton:
+                    automaton.add_word(keyword, (priority, qtype))
+        automaton.make_automaton()
+        return automaton
     
     def analyze_query(self, query: str) -> str:
         """Determine the type of context needed for the query"""
         query_lower = query.lower()
         
-        for qtype, keywords in self.query_types.items():
-            for keyword in keywords:
-                if keyword in query_lower:
-                    return qtype
+        # Single pass over the query finds every keyword occurrence
+        if self._automaton is not None:
+            matches = [match for _, match in self._automaton.iter(query_lower)]
+            return min(matches)[1] if matches else 'general'
+        
+        for qtype, pattern in self._patterns:
+            if pattern.search(query_lower):
+                return qtype
         
         # Default to general context
         return 'general'
\ No newline at end of file
@@ -1,62 +1,123 @@
 # android_code_ai/dependency_graph.py
-import hashlib
-import networkx as nx
+import mmap
+import os
+from array import array
 from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+# The one content hasher: the AST cache keys and the indexer's change tracking
+# must produce identical digests, so other modules import it from here
+try:
+    from blake3 import blake3 as file_hasher
+except ImportError:
+    from hashlib import sha256 as file_hasher
 
 class DependencyGraph:
     """Manages file relationships and dependencies"""
     def __init__(self):
-        self.graph = nx.DiGraph()
+        # Files are interned to integer ids; edges live in per-file int arrays
+        self._ids = {}
+        self._paths = []
+        self._fwd = []
+        self._rev = []
         self.file_hashes = {}
+        self.file_stats = {}
     
     def add_file(self, file_path: str):
-        """Add a file to the graph"""
-        if file_path not in self.graph:
-            self.graph.add_node(file_path)
-            self.file_hashes[file_path] = self._calculate_file_hash(file_path)
+        """Add a file to the graph; its hash is recorded separately once it is indexed"""
+        self._add_node(file_path)
+    
+    def _add_node(self, file_path: str) -> int:
+        """Intern a file path, returning its id without hashing the file"""
+        file_id = self._ids.get(file_path)
+        if file_id is None:
+            file_id = self._ids[file_path] = len(self._paths)
+            self._paths.append(file_path)
+            self._fwd.append(array('i'))
+            self._rev.append(array('i'))
+        return file_id
     
     def add_dependency(self, source: str, target: str, rel_type: str = "imports"):
         """Add a dependency relationship between files"""
-        self.add_file(source)
-        self.add_file(target)
-        
-        if not self.graph.has_edge(source, target):
-            self.graph.add_edge(source, target, type=rel_type)
+        # Edges only need ids; hashes are recorded when a file itself is indexed
+        source_id = self._add_node(source)
+        target_id = self._add_node(target)
+        if target_id not in self._fwd[source_id]:
+            self._fwd[source_id].append(target_id)
+            self._rev[target_id].append(source_id)
     
     def get_related_files(self, file_path: str, depth: int = 2) -> list:
         """Get files related to the given file within a certain depth"""
-        if file_path not in self.graph:
+        file_id = self._ids.get(file_path)
+        if file_id is None:
             return []
         
-        related = set()
-        # Get files that depend on this file
-        for ancestor in nx.ancestors(self.graph, file_path):
-            if nx.shortest_path_length(self.graph, ancestor, file_path) <= depth:
-                related.add(ancestor)
-        
-        # Get files this file depends on
-        for descendant in nx.descendants(self.graph, file_path):
-            if nx.shortest_path_length(self.graph, file_path, descendant) <= depth:
-                related.add(descendant)
+        # Files this file depends on, then files that depend on this file
+        related = self._bfs(self._fwd, file_id, depth)
+        related.update(self._bfs(self._rev, file_id, depth))
+        related.discard(file_id)
         
-        return list(related)
+        return [self._paths[related_id] for related_id in related]
     
-    def has_changed(self, file_path: str) -> bool:
+    def _bfs(self, adjacency: List[array], start: int, depth: int) -> Set[int]:
+        """Collect ids reachable from start within depth hops"""
+        seen = {start}
+        frontier = [start]
+        for _ in range(depth):
+            next_frontier = []
+            for node_id in frontier:
+                for neighbor_id in adjacency[node_id]:
+                    if neighbor_id not in seen:
+                        seen.add(neighbor_id)
+                        next_frontier.append(neighbor_id)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return seen
+    
+    def has_changed(self, file_path: str, stat_result: Optional[os.stat_result] = None) -> bool:
         """Check if a file has changed since last index"""
         if file_path not in self.file_hashes:
             return True
         
+        # Same mtime and size as when last hashed: skip re-hashing the content
+        if stat_result is not None and \
+                self.file_stats.get(file_path) == (stat_result.st_mtime_ns, stat_result.st_size):
+            return False
+        
         current_hash = self._calculate_file_hash(file_path)
-        return current_hash != self.file_hashes[file_path]
+        if current_hash != self.file_hashes[file_path]:
+            return True
+        # Touched but unchanged (checkout, rebase): remember the new stat so the
+        # fast path applies again next time
+        if stat_result is not None:
+            self.file_stats[file_path] = (stat_result.st_mtime_ns, stat_result.st_size)
+        return False
     
-    def update_hash(self, file_path: str):
-        """Update the hash for a file"""
-        self.file_hashes[file_path] = self._calculate_file_hash(file_path)
+    def update_hash(self, file_path: str, file_hash: Optional[str] = None,
+                    file_stat: Optional[Tuple[int, int]] = None):
+        """Update the hash for a file, reusing the hash and (mtime_ns, size) taken when it was read"""
+        if file_hash is None:
+            file_hash = self._calculate_file_hash(file_path)
+        self.file_hashes[file_path] = file_hash
+        if file_stat is not None:
+            self.file_stats[file_path] = file_stat
+            return
+        try:
+            st = os.stat(file_path)
+            self.file_stats[file_path] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            self.file_stats.pop(file_path, None)
     
     def _calculate_file_hash(self, file_path: str) -> str:
         """Calculate file hash for change detection"""
         try:
+            hasher = file_hasher()
             with open(file_path, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+                # mmap cannot map empty files; hash them as empty input
+                if os.fstat(f.fileno()).st_size:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        hasher.update(mm)
+            return hasher.hexdigest()
         except:
             return ""
\ No newline at end of file
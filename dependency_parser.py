@@ -1,8 +1,25 @@
 # android_code_ai/dependency_parser.py
+import mmap
+import os
 import re
-import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
 from typing import Dict, List
+from .xml_analyzer import read_manifest
+
+# Single pass over a Gradle file: dependency coordinates, plugins and DI libraries
+GRADLE_RE = re.compile(
+    r"(?P<dep>(?:implementation|api|compile|kapt|ksp)\s*\(?\s*['\"](?P<coord>[^:'\"]+:[^:'\"]+)['\"])"
+    r"|(?P<android>com\.android\.(?:application|library))"
+    r"|(?P<kotlin>org\.jetbrains\.kotlin\.android)"
+    r"|(?P<di>com\.google\.dagger(?:[:.][^\s'\")]+)?|io\.insert-koin:[^\s'\")]+)"
+)
+
+DI_LIBRARIES = {
+    'dagger': ['com.google.dagger:dagger', 'com.google.dagger:hilt-android'],
+    'hilt': ['com.google.dagger:hilt-android', 'com.google.dagger.hilt.android'],
+    'koin': ['io.insert-koin:koin-android', 'io.insert-koin:koin-core']
+}
 
 class AndroidDependencyParser:
     def __init__(self, project_root: str):
@@ -26,42 +43,56 @@ class AndroidDependencyParser:
         build_gradle_files = list(Path(self.project_root).rglob('build.gradle')) + \
                            list(Path(self.project_root).rglob('build.gradle.kts'))
         
-        for gradle_file in build_gradle_files:
-            try:
-                with open(gradle_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    
-                    # Find dependencies
-                    dep_pattern = r"(implementation|api|compile|kapt|ksp)\s*\(?\s*['\"]([^:'\"]+:[^:'\"]+)['\"]"
-                    matches = re.finditer(dep_pattern, content)
-                    for match in matches:
-                        self.dependencies['libraries'].add(match.group(2))
-                    
-                    # Check for Android plugins
-                    if 'com.android.application' in content or 'com.android.library' in content:
-                        self.dependencies['gradle'].append('android_plugin')
-                    
-                    # Check for Kotlin plugins
-                    if 'org.jetbrains.kotlin.android' in content:
-                        self.dependencies['gradle'].append('kotlin_plugin')
-                    
-                    # Check for DI frameworks
-                    self._detect_di_frameworks(content)
-            except Exception as e:
-                pass
+        # Scan files concurrently, merging results in file order
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for findings in executor.map(self._scan_gradle_file, build_gradle_files):
+                self.dependencies['libraries'].update(findings['libraries'])
+                self.dependencies['gradle'].extend(findings['gradle'])
+                self.dependencies['di_frameworks'].update(findings['di_frameworks'])
     
-    def _detect_di_frameworks(self, content: str):
-        """Detect DI frameworks in Gradle files"""
-        di_libraries = {
-            'dagger': ['com.google.dagger:dagger', 'com.google.dagger:hilt-android'],
-            'hilt': ['com.google.dagger:hilt-android', 'com.google.dagger.hilt.android'],
-            'koin': ['io.insert-koin:koin-android', 'io.insert-koin:koin-core']
+    def _scan_gradle_file(self, gradle_file: Path) -> Dict:
+        """Collect dependency findings from a single Gradle file"""
+        findings = {
+            'libraries': set(),
+            'gradle': [],
+            'di_frameworks': set()
         }
-        
-        for framework, libs in di_libraries.items():
+        try:
+            with open(gradle_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+            
+            has_android_plugin = has_kotlin_plugin = False
+            for match in GRADLE_RE.finditer(content):
+                kind = match.lastgroup
+                if kind == 'dep':
+                    # Find dependencies
+                    coord = match.group('coord')
+                    findings['libraries'].add(coord)
+                    findings['di_frameworks'].update(self._detect_di_frameworks(coord))
+                elif kind == 'android':
+                    has_android_plugin = True
+                elif kind == 'kotlin':
+                    has_kotlin_plugin = True
+                else:
+                    findings['di_frameworks'].update(self._detect_di_frameworks(match.group('di')))
+            
+            # Check for Android and Kotlin plugins
+            if has_android_plugin:
+                findings['gradle'].append('android_plugin')
+            if has_kotlin_plugin:
+                findings['gradle'].append('kotlin_plugin')
+        except Exception as e:
+            pass
+        return findings
+    
+    def _detect_di_frameworks(self, content: str) -> set:
+        """Detect DI frameworks referenced in a Gradle snippet"""
+        frameworks = set()
+        for framework, libs in DI_LIBRARIES.items():
             for lib in libs:
                 if lib in content:
-                    self.dependencies['di_frameworks'].add(framework)
+                    frameworks.add(framework)
+        return frameworks
     
     def _parse_manifest(self):
         """Parse AndroidManifest.xml for permissions and components"""
@@ -70,21 +101,13 @@ class AndroidDependencyParser:
             return
             
         try:
-            tree = ET.parse(manifest_path)
-            root = tree.getroot()
-            
-            # Parse uses-permission
-            for perm in root.findall('.//uses-permission'):
-                android_name = perm.get('{http://schemas.android.com/apk/res/android}name')
-                if android_name:
-                    self.dependencies['manifest'].append(android_name)
+            permissions, application_attrib = read_manifest(manifest_path)
+            self.dependencies['manifest'].extend(permissions)
             
             # Parse application attributes
-            application = root.find('application')
-            if application is not None:
-                for attr in application.attrib:
-                    if 'theme' in attr or 'name' in attr:
-                        self.dependencies['manifest'].append(f"{attr}:{application.attrib[attr]}")
+            for attr, value in (application_attrib or {}).items():
+                if 'theme' in attr or 'name' in attr:
+                    self.dependencies['manifest'].append(f"{attr}:{value}")
         except:
             pass
     
@@ -99,14 +122,39 @@ class AndroidDependencyParser:
         
         if any(dep in self.dependencies['libraries'] for dep in compose_deps):
             self.dependencies['compose'] = True
+            return
         
-        # Also check for Compose in Kotlin files
-        compose_files = list(Path(self.project_root).rglob('*.kt'))
-        for kt_file in compose_files[:10]:  # Check first 10 files
+        # Also check for Compose in Kotlin files, stopping the walk at the first hit
+        if self._any_uses_compose(Path(self.project_root).rglob('*.kt')):
+            self.dependencies['compose'] = True
+    
+    def _any_uses_compose(self, kt_files) -> bool:
+        """Scan Kotlin files concurrently until one declares a Composable"""
+        max_workers = os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
             try:
-                with open(kt_file, 'r', encoding='utf-8') as f:
-                    if '@Composable' in f.read():
-                        self.dependencies['compose'] = True
-                        break
-            except:
-                continue
\ No newline at end of file
+                for kt_file in kt_files:
+                    pending.add(executor.submit(self._uses_compose, kt_file))
+                    # Keep a bounded number of scans in flight so a hit ends the walk early
+                    if len(pending) >= max_workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        if any(future.result() for future in done):
+                            return True
+                
+                for future in as_completed(pending):
+                    if future.result():
+                        return True
+                return False
+            finally:
+                for future in pending:
+                    future.cancel()
+    
+    def _uses_compose(self, kt_file: Path) -> bool:
+        """Check whether a Kotlin file declares Composables"""
+        try:
+            # Search the raw bytes in place rather than reading and decoding the file
+            with open(kt_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm.find(b'@Composable') != -1
+        except:
+            return False
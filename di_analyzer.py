@@ -2,6 +2,17 @@
 import re
 from typing import Dict, Optional
 
+# Dagger/Hilt declarations
+COMPONENT_RE = re.compile(r'@Component(?:\([^)]*\))?\s+(?:interface|abstract\s+class)\s+(\w+)')
+MODULE_RE = re.compile(r'@Module(?:\([^)]*\))?\s+(?:class|interface|object)\s+(\w+)')
+PROVIDER_RE = re.compile(r'@Provides\s+(?:fun|def)\s+(\w+)')
+INJECT_RE = re.compile(r'@Inject\s+(?:lateinit\s+var|val|var)\s+(\w+)')
+
+# Koin declarations
+KOIN_MODULE_RE = re.compile(r'val\s+(\w+)\s*=\s*module\s*\{')
+SINGLE_RE = re.compile(r'single\s*\{[^}]*?\s+(\w+)\s*\(')
+FACTORY_RE = re.compile(r'factory\s*\{[^}]*?\s+(\w+)\s*\(')
+
 class DIAnalyzer:
     def __init__(self):
         self.di_frameworks = {
@@ -18,6 +29,13 @@ class DIAnalyzer:
                 'patterns': [r'startKoin', r'module\s*{', r'single\s*{', r'factory\s*{']
             }
         }
+        # One alternation per framework so detection is a single regex scan each
+        self._detect_re = {
+            framework: re.compile('|'.join(
+                [re.escape(annotation) for annotation in config['annotations']] + config['patterns']
+            ))
+            for framework, config in self.di_frameworks.items()
+        }
         self.detected_frameworks = set()
     
     def analyze_file(self, file_path: str, content: str) -> Optional[Dict]:
@@ -49,16 +67,9 @@ class DIAnalyzer:
     
     def _detect_framework(self, content: str) -> Optional[str]:
         """Detect which DI framework is being used"""
-        for framework, config in self.di_frameworks.items():
-            # Check for annotations
-            for annotation in config['annotations']:
-                if annotation in content:
-                    return framework
-            
-            # Check for patterns
-            for pattern in config['patterns']:
-                if re.search(pattern, content):
-                    return framework
+        for framework, detect_re in self._detect_re.items():
+            if detect_re.search(content):
+                return framework
         return None
     
     def _analyze_dagger_hilt(self, content: str) -> Dict:
@@ -71,19 +82,19 @@ class DIAnalyzer:
         }
         
         # Find components
-        component_matches = re.finditer(r'@Component(?:\([^)]*\))?\s+(?:interface|abstract\s+class)\s+(\w+)', content)
+        component_matches = COMPONENT_RE.finditer(content)
         analysis['components'] = [m.group(1) for m in component_matches]
         
         # Find modules
-        module_matches = re.finditer(r'@Module(?:\([^)]*\))?\s+(?:class|interface|object)\s+(\w+)', content)
+        module_matches = MODULE_RE.finditer(content)
         analysis['modules'] = [m.group(1) for m in module_matches]
         
         # Find providers
-        provider_matches = re.finditer(r'@Provides\s+(?:fun|def)\s+(\w+)', content)
+        provider_matches = PROVIDER_RE.finditer(content)
         analysis['providers'] = [m.group(1) for m in provider_matches]
         
         # Find injection points
-        inject_matches = re.finditer(r'@Inject\s+(?:lateinit\s+var|val|var)\s+(\w+)', content)
+        inject_matches = INJECT_RE.finditer(content)
         analysis['injection_points'] = [m.group(1) for m in inject_matches]
         
         return analysis
@@ -96,12 +107,12 @@ class DIAnalyzer:
         }
         
         # Find module declarations
-        module_matches = re.finditer(r'val\s+(\w+)\s*=\s*module\s*\{', content)
+        module_matches = KOIN_MODULE_RE.finditer(content)
         analysis['modules'] = [m.group(1) for m in module_matches]
         
         # Find provider declarations
-        single_matches = re.finditer(r'single\s*\{[^}]*?\s+(\w+)\s*\(', content)
-        factory_matches = re.finditer(r'factory\s*\{[^}]*?\s+(\w+)\s*\(', content)
+        single_matches = SINGLE_RE.finditer(content)
+        factory_matches = FACTORY_RE.finditer(content)
         analysis['providers'] = [m.group(1) for m in single_matches] + [m.group(1) for m in factory_matches]
         
         return analysis
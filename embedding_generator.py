@@ -1,25 +1,105 @@
 # android_code_ai/embedding_generator.py
 import hashlib
+import logging
+import mmap
+import os
+from collections import Counter, defaultdict
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("AndroidCodeAI")
 
 class AndroidEmbeddingGenerator:
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+    BATCH_SIZE = 128
+    
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', onnx_file_name: Optional[str] = None):
+        self.model = self._load_model(model_name, onnx_file_name)
+    
+    def _load_model(self, model_name: str, onnx_file_name: Optional[str]) -> SentenceTransformer:
+        """Load the encoder on GPU if available, otherwise on ONNX Runtime"""
+        if torch.cuda.is_available():
+            # Half precision weights on GPU halve memory traffic during encoding
+            return SentenceTransformer(model_name, device='cuda').half()
+        
+        # ONNX Runtime is markedly faster than eager PyTorch on CPU; onnx_file_name
+        # selects an exported variant such as 'onnx/model_qint8_avx512_vnni.onnx'
+        model_kwargs = {'file_name': onnx_file_name} if onnx_file_name else None
+        try:
+            return SentenceTransformer(model_name, backend='onnx', model_kwargs=model_kwargs)
+        except Exception as e:
+            logger.warning(f"ONNX backend unavailable, using PyTorch: {str(e)}")
+            return SentenceTransformer(model_name)
     
-    def generate_embeddings(self, chunks: List[Dict]) -> List[Dict]:
-        """Generate embeddings for each chunk"""
+    def generate_embeddings(self, chunks: List[Dict],
+                            file_stats: Optional[Dict[str, Tuple[int, int]]] = None) -> List[Dict]:
+        """Generate embeddings for each chunk, returning the chunks whose text could be loaded"""
+        chunks = self._load_contents(chunks, file_stats)
+        if not chunks:
+            return chunks
         chunk_texts = [chunk['content'] for chunk in chunks]
-        embeddings = self.model.encode(chunk_texts)
+        # encode() already length-sorts texts internally to minimise padding; unit-norm
+        # vectors keep their similarity ranking in float16 at half the memory while queued
+        embeddings = self.model.encode(
+            chunk_texts,
+            batch_size=self.BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            normalize_embeddings=True
+        ).astype(np.float16, copy=False)
         
         # Add embeddings to chunks
-        for i, chunk in enumerate(chunks):
-            chunk['embedding'] = embeddings[i].tolist()
+        occurrences = Counter()
+        for chunk, embedding in zip(chunks, embeddings):
+            chunk['embedding'] = embedding
             
-            # Generate a unique ID for the chunk
+            # Number repeated chunk types within a file so IDs are unique, and
+            # stable across reindexing so a re-stored chunk overwrites its old copy
+            key = (chunk['file_path'], chunk['type'])
+            occurrences[key] += 1
             chunk_id = hashlib.md5(
-                f"{chunk['file_path']}-{chunk['type']}".encode()
+                f"{chunk['file_path']}-{chunk['type']}-{occurrences[key]}".encode()
             ).hexdigest()
             chunk['chunk_id'] = chunk_id
         
+        return chunks
+    
+    def generate_query_embedding(self, query: str) -> np.ndarray:
+        """Embed a search query the same way chunks are embedded"""
+        return self.model.encode(
+            query,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+    
+    def _load_contents(self, chunks: List[Dict],
+                       file_stats: Optional[Dict[str, Tuple[int, int]]] = None) -> List[Dict]:
+        """Materialize text for chunks stored as byte offsets, mapping each file once"""
+        chunks_by_file = defaultdict(list)
+        for chunk in chunks:
+            if 'content' not in chunk:
+                chunks_by_file[chunk['file_path']].append(chunk)
+        
+        # A file that vanished or changed since chunking only loses its own chunks
+        failed_files = set()
+        for file_path, file_chunks in chunks_by_file.items():
+            try:
+                with open(file_path, 'rb') as f:
+                    # Offsets are only valid for the bytes that were chunked; the worker's
+                    # (mtime_ns, size) for them is compared instead of re-hashing the file
+                    expected_stat = file_stats.get(file_path) if file_stats else None
+                    st = os.fstat(f.fileno())
+                    if expected_stat and (st.st_mtime_ns, st.st_size) != tuple(expected_stat):
+                        raise ValueError("file changed since it was chunked")
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        for chunk in file_chunks:
+                            chunk['content'] = mm[chunk['start']:chunk['end']].decode('utf-8')
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping chunks of {file_path}: {str(e)}")
+                failed_files.add(file_path)
+        
+        if failed_files:
+            return [chunk for chunk in chunks if chunk['file_path'] not in failed_files]
         return chunks
\ No newline at end of file
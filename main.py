@@ -11,7 +11,6 @@ from .dependency_graph import DependencyGraph
 from .project_indexer import ProjectIndexer
 from .context_retrieval import ContextRetrievalEngine
 from .rag_system import AndroidRAGSystem
-from .vector_db import AndroidVectorDB
 import openai
 
 # Configure logging
@@ -30,7 +29,8 @@ class AndroidCodeAI:
         self.project_root = project_root
         self.dep_graph = DependencyGraph()
         self.indexer = ProjectIndexer(project_root, self.dep_graph)
-        self.vector_db = AndroidVectorDB()
+        # Share the indexer's store so queries see the keyword index it builds
+        self.vector_db = self.indexer.vector_db
         self.context_engine = ContextRetrievalEngine(self.vector_db)
         self.rag = AndroidRAGSystem(self.context_engine)
         self.last_query_time = 0
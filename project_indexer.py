@@ -1,8 +1,9 @@
 # android_code_ai/project_indexer.py
+import os
 import time
 import logging
-from pathlib import Path
-from typing import Tuple
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
 from .dependency_graph import DependencyGraph
 from .ast_parser import ASTParser
 from .dependency_parser import AndroidDependencyParser
@@ -13,14 +14,20 @@ logger = logging.getLogger("AndroidCodeAI")
 
 class ProjectIndexer:
     """Handles project indexing operations with incremental updates"""
+    STORE_BATCH_SIZE = 5000  # Embeddings per vector DB insert
+    SKIP_DIRS = frozenset({'build', '.gradle', '.git', '.idea', 'generated', 'node_modules'})
+    MAX_FILE_SIZE = 2 * 1024 * 1024  # Larger sources are generated or vendored
+    
     def __init__(self, project_root: str, dep_graph: DependencyGraph):
         self.project_root = project_root
         self.parser = ASTParser(dep_graph)
         self.dependency_parser = AndroidDependencyParser(project_root)
         self.embedding_generator = AndroidEmbeddingGenerator()
-        self.vector_db = AndroidVectorDB()
+        self.vector_db = AndroidVectorDB(embedding_generator=self.embedding_generator)
         self.dep_graph = dep_graph
         self.last_index_time = 0
+        self._pending_chunks = []
+        self._pending_files = []
     
     def index_project(self, full_index: bool = False):
         """Index the entire Android project or update changed files"""
@@ -36,58 +43,155 @@ class ProjectIndexer:
         
         # Process files
         file_extensions = ('.java', '.kt', '.xml', '.gradle', '.kts', '.properties')
-        if full_index:
+        # A recreated vector collection is empty, so every file must be indexed again
+        if full_index or self.vector_db.needs_full_reindex:
             self._full_index(file_extensions)
         else:
             self._incremental_index(file_extensions)
         
+        # Store the final partial batch; the keyword index is rebuilt only if chunks changed
+        self._flush_chunks()
+        self.vector_db.needs_full_reindex = False
+        self.vector_db.build_bm25_if_dirty()
+        
         logger.info("Project indexing completed!")
     
     def _full_index(self, file_extensions: Tuple[str]):
         """Perform a full index of all files"""
-        for ext in file_extensions:
-            for file_path in Path(self.project_root).rglob(f'*{ext}'):
-                try:
-                    self._process_file(file_path)
-                except Exception as e:
-                    logger.error(f"Error processing {file_path}: {str(e)}")
+        file_paths = [entry.path for entry in self._iter_source_files(file_extensions)]
+        self._index_files(file_paths)
         self.last_index_time = time.time()
     
     def _incremental_index(self, file_extensions: Tuple[str]):
         """Update only changed files"""
         changed_files = []
-        for ext in file_extensions:
-            for file_path in Path(self.project_root).rglob(f'*{ext}'):
-                if self.dep_graph.has_changed(file_path):
-                    changed_files.append(file_path)
+        for entry in self._iter_source_files(file_extensions):
+            if self.dep_graph.has_changed(entry.path, entry.stat()):
+                changed_files.append(entry.path)
         
         logger.info(f"Found {len(changed_files)} changed files to index")
         
         # Process changed files
-        for file_path in changed_files:
-            try:
-                self._process_file(file_path)
-                self.dep_graph.update_hash(file_path)
-            except Exception as e:
-                logger.error(f"Error processing {file_path}: {str(e)}")
-        
+        self._index_files(changed_files)
         self.last_index_time = time.time()
     
-    def _process_file(self, file_path: Path):
-        """Process a single file and store its chunks"""
-        logger.info(f"Processing {file_path}")
-        
-        # Add to dependency graph
-        self.dep_graph.add_file(str(file_path))
+    def _index_files(self, file_paths: List[str]):
+        """Chunk files in worker processes, then embed and store them here in batches"""
+        remaining = file_paths
+        while remaining:
+            processed = self._index_with_pool(remaining)
+            if processed == len(remaining):
+                break
+            
+            # A worker died; store what is already queued before retrying
+            self._flush_chunks()
+            remaining = remaining[processed:]
+            # The break fails every file in flight, not just the one that killed the pool,
+            # so bisect those and go on with the rest in a fresh pool
+            in_flight = self.parser.max_in_flight
+            self._isolate_broken(remaining[:in_flight])
+            remaining = remaining[in_flight:]
+    
+    def _isolate_broken(self, file_paths: List[str]):
+        """Re-run files a broken pool failed, halving them until the file that kills workers is found"""
+        if len(file_paths) == 1:
+            logger.error(f"Could not process {file_paths[0]}: chunking worker died")
+            return
         
-        # Extract chunks
-        chunks = self.parser.extract_chunks(str(file_path))
+        middle = len(file_paths) // 2
+        for half in (file_paths[:middle], file_paths[middle:]):
+            processed = self._index_with_pool(half)
+            if processed < len(half):
+                self._flush_chunks()
+                self._isolate_broken(half[processed:])
+    
+    def _index_with_pool(self, file_paths: List[str]) -> int:
+        """Queue chunks from one worker pool, returning how many files it processed before breaking"""
+        processed = 0
+        try:
+            for file_path, chunks, file_hash, file_stat in self.parser.extract_chunks_batch(file_paths):
+                processed += 1
+                logger.info(f"Processing {file_path}")
+                try:
+                    self._queue_file_chunks(file_path, chunks, file_hash, file_stat)
+                except Exception as e:
+                    logger.error(f"Error processing {file_path}: {str(e)}")
+        except BrokenProcessPool as e:
+            logger.error(f"Chunking worker pool broke after {processed} of {len(file_paths)} files: {str(e)}")
+        return processed
+    
+    def _iter_source_files(self, file_extensions: Tuple[str]) -> Iterator[os.DirEntry]:
+        """Walk the project once, yielding entries for files with indexed extensions"""
+        pending_dirs = [self.project_root]
+        skipped_dirs = oversized_files = 0
+        while pending_dirs:
+            try:
+                with os.scandir(pending_dirs.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            # Prune build outputs, generated code and tool metadata
+                            if entry.name in self.SKIP_DIRS:
+                                skipped_dirs += 1
+                            else:
+                                pending_dirs.append(entry.path)
+                        elif entry.name.endswith(file_extensions):
+                            # DirEntry caches the stat, so change detection reuses it
+                            try:
+                                file_size = entry.stat().st_size
+                            except OSError:
+                                continue
+                            if file_size > self.MAX_FILE_SIZE:
+                                oversized_files += 1
+                            else:
+                                yield entry
+            except OSError as e:
+                logger.warning(f"Cannot scan directory: {str(e)}")
         
-        # Generate embeddings for chunks
-        chunks_with_embeddings = self.embedding_generator.generate_embeddings(chunks)
+        logger.info(f"Skipped {skipped_dirs} excluded directories and {oversized_files} files over {self.MAX_FILE_SIZE} bytes")
+    
+    def _queue_file_chunks(self, file_path: str, chunks: List[Dict], file_hash: str,
+                           file_stat: Optional[Tuple[int, int]]):
+        """Queue a file's chunks, embedding and storing them once a batch fills up"""
+        # Add to dependency graph; the hash is only recorded once the chunks are stored
+        self.dep_graph.add_file(file_path)
         
-        # Store chunks in vector DB
-        self.vector_db.store_chunks(chunks_with_embeddings)
+        # An empty hash means the worker could not read the file, so leave it unindexed
+        if not file_hash:
+            return
+        self._pending_chunks.extend(chunks)
+        self._pending_files.append((file_path, file_hash, file_stat))
+        if len(self._pending_chunks) >= self.STORE_BATCH_SIZE:
+            self._flush_chunks()
+    
+    def _flush_chunks(self):
+        """Embed and store all queued chunks, then mark their files as indexed"""
+        if not self._pending_files:
+            return
         
-        # Update hash in dependency graph
-        self.dep_graph.update_hash(str(file_path))
\ No newline at end of file
+        try:
+            # One encode call across many files keeps the model's batches full
+            chunks_with_embeddings = []
+            skipped_files = set()
+            if self._pending_chunks:
+                file_stats = {file_path: file_stat for file_path, _, file_stat in self._pending_files}
+                chunks_with_embeddings = self.embedding_generator.generate_embeddings(self._pending_chunks, file_stats)
+                # Files whose text could no longer be loaded stay unhashed and are retried
+                skipped_files = {chunk['file_path'] for chunk in self._pending_chunks} - \
+                    {chunk['file_path'] for chunk in chunks_with_embeddings}
+            
+            # Replace everything stored for these files, including chunks they no longer produce
+            self.vector_db.delete_files([
+                file_path for file_path, _, _ in self._pending_files if file_path not in skipped_files
+            ])
+            self.vector_db.store_chunks(chunks_with_embeddings)
+            
+            # Update hashes only once the files' chunks are stored, using the hash
+            # and stat the worker took when it read them
+            for file_path, file_hash, file_stat in self._pending_files:
+                if file_path not in skipped_files:
+                    self.dep_graph.update_hash(file_path, file_hash, file_stat)
+        except Exception as e:
+            logger.error(f"Error storing {len(self._pending_files)} files: {str(e)}")
+        finally:
+            self._pending_chunks = []
+            self._pending_files = []
\ No newline at end of file
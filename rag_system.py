@@ -1,37 +1,80 @@
 # android_code_ai/rag_system.py
 import openai
-from typing import Dict
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, CompileConfig, StaticCache
 import torch
 
-class AndroidRAGSystem:
-    MAX_CONTEXT_TOKENS = 4000  # Max tokens for context
-    
-    def __init__(self, context_engine):
-        self.context_engine = context_engine
-        # Define the save directory
-        save_directory = "./deepseek-ai/deepseek-coder-1.3b-base-saved"
+MODEL_NAME = "deepseek-ai/deepseek-coder-1.3b-base"
+SAVE_DIRECTORY = "./deepseek-ai/deepseek-coder-1.3b-base-saved"
 
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "deepseek-ai/deepseek-coder-1.3b-base", trust_remote_code=True)
-        self.bnb_config = BitsAndBytesConfig(
+@lru_cache(maxsize=None)
+def _load_model_and_tokenizer(max_cache_len: int):
+    """Load the tokenizer, model and (on CUDA) a preallocated KV cache once per process"""
+    # Prefer the local copy once it has been saved
+    saved = Path(SAVE_DIRECTORY, 'config.json').exists()
+    source = SAVE_DIRECTORY if saved else MODEL_NAME
+    
+    tokenizer = AutoTokenizer.from_pretrained(source, trust_remote_code=True)
+    # Weight-only NF4 cuts weight traffic per decode step; bitsandbytes needs CUDA
+    bnb_config = None
+    torch_dtype = None
+    if torch.cuda.is_available():
+        compute_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        bnb_config = BitsAndBytesConfig(
                 load_in_4bit=True,
-                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_compute_dtype=compute_dtype,
                 bnb_4bit_use_double_quant=True,
                 bnb_4bit_quant_type="nf4"
         )
-        self.model = AutoModelForCausalLM.from_pretrained(
-            save_directory, 
-            device_map='auto',
-            trust_remote_code=True,
-            # quantization_config= self.bnb_config
-            )
-        print(f"model size {self.model.get_memory_footprint()/1024/1024/1024} GB")
-        self.model.config.pad_token_id = self.model.config.eos_token_id
-        self.tokenizer.pad_token = self.tokenizer.eos_token
-        # Save the model
-        self.model.save_pretrained(save_directory)
-        self.tokenizer.save_pretrained(save_directory)
+        # Without this, transformers casts the non-quantized weights and activations
+        # to float16, so bf16 would only cover the 4-bit matmuls
+        torch_dtype = compute_dtype
+    model = AutoModelForCausalLM.from_pretrained(
+        source, 
+        device_map='auto',
+        trust_remote_code=True,
+        quantization_config=bnb_config,
+        torch_dtype=torch_dtype,
+        attn_implementation="sdpa"
+        )
+    print(f"model size {model.get_memory_footprint()/1024/1024/1024} GB")
+    model.config.pad_token_id = model.config.eos_token_id
+    tokenizer.pad_token = tokenizer.eos_token
+    
+    # Save a local full-precision copy exactly once; 4-bit weights are never saved
+    if not saved and bnb_config is None:
+        model.save_pretrained(SAVE_DIRECTORY)
+        tokenizer.save_pretrained(SAVE_DIRECTORY)
+    
+    kv_cache = None
+    if torch.cuda.is_available():
+        # One static KV cache sized for the whole context keeps decode shapes fixed
+        # across prompts, so the compiled decode step (with CUDA graphs) is recorded
+        # once and reused. generate() runs prefill eagerly and compiles only the
+        # single-token decode step, since prompt lengths differ on nearly every query
+        # and would otherwise recompile and record a new graph each time. Graph
+        # breaks are allowed since 4-bit bitsandbytes layers may not be traceable.
+        kv_cache = StaticCache(
+            config=model.config,
+            batch_size=1,
+            max_cache_len=max_cache_len,
+            device=model.device,
+            dtype=model.dtype
+        )
+        model.generation_config.compile_config = CompileConfig(mode="reduce-overhead", fullgraph=False)
+    return tokenizer, model, kv_cache
+
+class AndroidRAGSystem:
+    MAX_CONTEXT_TOKENS = 4000  # Max tokens for context
+    MAX_NEW_TOKENS = 140
+    TOKEN_CACHE_SIZE = 50000
+    
+    def __init__(self, context_engine):
+        self.context_engine = context_engine
+        self.tokenizer, self.model, self._kv_cache = _load_model_and_tokenizer(self.MAX_CONTEXT_TOKENS)
+        self._token_counts = {}
     
     def generate_response(self, query: str) -> str:
         """Generate an AI response with automatically retrieved context"""
@@ -48,34 +91,103 @@ class AndroidRAGSystem:
         
         return response
     
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        """Token counts for texts, batch-tokenizing only those not seen before"""
+        missing = list({text for text in texts if text not in self._token_counts})
+        if missing:
+            if len(self._token_counts) + len(missing) > self.TOKEN_CACHE_SIZE:
+                self._token_counts.clear()
+            encoded = self.tokenizer(missing, add_special_tokens=False)['input_ids']
+            self._token_counts.update(zip(missing, map(len, encoded)))
+        return [self._token_counts[text] for text in texts]
+    
+    def _select_chunks(self, chunks: List[Dict], budget: int) -> List[Dict]:
+        """Greedily keep the highest-scoring chunks whose tokens, headers included, fit the budget"""
+        # Headers use each chunk's rank, which is never below its final snippet number
+        texts = []
+        for rank, chunk in enumerate(chunks, 1):
+            metadata = chunk['metadata']
+            texts += [
+                chunk['document'],
+                self._snippet_header(rank, metadata),
+                self._entry_header(metadata),
+                self._file_header(metadata['file_path']),
+            ]
+        token_counts = self._count_tokens(texts + ['\n'])
+        newline = token_counts.pop()
+        
+        selected = []
+        listed_files = set()
+        for i, chunk in enumerate(chunks):
+            document, snippet, entry, file_header = token_counts[4 * i:4 * i + 4]
+            # Listed as a snippet (plus its newline and join) and again under its file
+            cost = snippet + entry + 2 * document + 3 * newline
+            file_path = chunk['metadata']['file_path']
+            if file_path not in listed_files:
+                # Each file's header, with its trailing newline and join, is paid once
+                cost += file_header + 2 * newline
+            if cost <= budget:
+                selected.append(chunk)
+                listed_files.add(file_path)
+                budget -= cost
+        return selected
+    
+    @staticmethod
+    def _snippet_header(number: int, metadata: Dict) -> str:
+        """Header opening a chunk in the snippets section"""
+        return f"### Snippet {number} ({metadata['type']})\nFile: {metadata['file_path']}\n"
+    
+    @staticmethod
+    def _entry_header(metadata: Dict) -> str:
+        """Header opening a chunk under its file"""
+        return f"- {metadata['type']}:\n"
+    
+    @staticmethod
+    def _file_header(file_path: str) -> str:
+        """Header opening a file in the relevant files section"""
+        return f"### File: {file_path}\n"
+    
     def _build_prompt(self, query: str, context: Dict) -> str:
         """Build a comprehensive prompt with automatically retrieved context"""
         prompt_parts = [
             "You are an expert Android developer assistant. Use the following context from the codebase to answer the question.",
             f"Question: {query}\n\n"
         ]
+        snippets_title = "Most Relevant Code Snippets:"
+        files_title = "\nRelevant Files:"
+        closing = "\nProvide a comprehensive answer with code examples when applicable:"
+        
+        # Pack context into what is left after the question, section titles, joins and the answer
+        fixed_parts = prompt_parts + [snippets_title, files_title, closing]
+        *part_tokens, newline = self._count_tokens(fixed_parts + ['\n'])
+        fixed_tokens = sum(part_tokens) + (len(fixed_parts) - 1) * newline
+        budget = self.MAX_CONTEXT_TOKENS - self.MAX_NEW_TOKENS - fixed_tokens
+        selected = self._select_chunks(context['chunks'], budget)
         
         # Add chunk context
-        if context['chunks']:
-            prompt_parts.append("Most Relevant Code Snippets:")
-            for i, chunk in enumerate(context['chunks']):
-                prompt_parts.append(f"### Snippet {i+1} ({chunk['metadata']['type']})")
-                prompt_parts.append(f"File: {chunk['metadata']['file_path']}")
-                prompt_parts.append(chunk['document'])
-                prompt_parts.append("")
+        if selected:
+            prompt_parts.append(snippets_title)
+            prompt_parts.extend(
+                f"{self._snippet_header(i, chunk['metadata'])}{chunk['document']}\n"
+                for i, chunk in enumerate(selected, 1)
+            )
         
         # Add file context for the top files
-        if context['files']:
-            prompt_parts.append("\nRelevant Files:")
-            for file_path, chunks in context['files'].items():
-                prompt_parts.append(f"### File: {file_path}")
-                # Include only the chunk contents
-                for chunk in chunks:
-                    prompt_parts.append(f"- {chunk['type']}:")
-                    prompt_parts.append(chunk['content'])
-                prompt_parts.append("")
+        if selected:
+            prompt_parts.append(files_title)
+            # Group only the chunks that made it into the budget; matching by content
+            # would also list unselected chunks that happen to be identical
+            selected_by_file = {}
+            for chunk in selected:
+                selected_by_file.setdefault(chunk['metadata']['file_path'], []).append(chunk)
+            for file_path, chunks in selected_by_file.items():
+                entries = '\n'.join(
+                    f"{self._entry_header(chunk['metadata'])}{chunk['document']}"
+                    for chunk in chunks
+                )
+                prompt_parts.append(f"{self._file_header(file_path)}{entries}\n")
         
-        prompt_parts.append("\nProvide a comprehensive answer with code examples when applicable:")
+        prompt_parts.append(closing)
         return '\n'.join(prompt_parts)
     
     def _call_llm(self, prompt: str) -> str:
@@ -91,6 +203,19 @@ class AndroidRAGSystem:
         # )
         # return response.choices[0].message.content
 
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
-        outputs = self.model.generate(**inputs, max_new_tokens=140)
+        # Packing keeps prompts within budget; truncation is only a safety net
+        inputs = self.tokenizer(
+            prompt,
+            return_tensors="pt",
+            truncation=True,
+            max_length=self.MAX_CONTEXT_TOKENS - self.MAX_NEW_TOKENS
+        ).to(self.model.device)
+        if self._kv_cache is not None:
+            # Reuse the preallocated cache; clearing it keeps its shapes
+            self._kv_cache.reset()
+        outputs = self.model.generate(
+            **inputs,
+            max_new_tokens=self.MAX_NEW_TOKENS,
+            past_key_values=self._kv_cache
+        )
         return self.tokenizer.decode(outputs[0])
@@ -1,23 +1,105 @@
 # android_code_ai/vector_db.py
+import logging
+import os
+import pickle
+import re
+from itertools import chain
+from operator import itemgetter
 import chromadb
 import numpy as np
 from chromadb.config import Settings
 from rank_bm25 import BM25Okapi
-from typing import Dict, List
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger("AndroidCodeAI")
+
+# Identifier words: acronyms, CamelCase humps and digit runs ("parseHTTPResponse2" -> parse http response 2)
+TOKEN_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+
+def _tokenize(text: str) -> List[str]:
+    """Split text into lowercase identifier words for BM25"""
+    return [token.lower() for token in TOKEN_RE.findall(text)]
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place so inner product equals cosine similarity"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-12)
+    return matrix
 
 class AndroidVectorDB:
-    def __init__(self, db_path: str = "android_vector_db"):
+    COLLECTION_NAME = "code_chunks"
+    BM25_FILE = "bm25.pkl"
+    # Bump whenever tokenization changes so saved token lists are rebuilt
+    TOKENIZER_VERSION = 1
+    
+    def __init__(self, db_path: str = "android_vector_db", embedding_generator=None):
         self.client = chromadb.PersistentClient(
             path=db_path,
             settings=Settings(allow_reset=True)
         )
-        self.collection = self.client.get_or_create_collection(name="code_chunks")
+        self.collection = self._get_collection()
+        # Chroma rejects writes above this many records per call
+        self._max_batch_size = self.client.get_max_batch_size()
+        # Embeds queries with the model used for chunks; without it Chroma embeds query text
+        self.embedding_generator = embedding_generator
         self.bm25_index = None
         self.chunk_documents = []
         self.chunk_metadatas = []
+        self.tokenized_docs = []
+        # Position of each chunk ID in the lists above, so re-stored chunks replace in place
+        self._bm25_positions = {}
+        # Chunk IDs stored per file, so deletes find their entries without a corpus scan
+        self._file_chunk_ids = {}
+        # Positions of deleted entries, dropped from the lists once at the next build
+        self._tombstones = set()
+        self._bm25_dirty = False
+        # Object-array snapshots aligned with the BM25 index, for fancy-index gathers
+        self._bm25_documents = None
+        self._bm25_metadatas = None
+        # Keyword index saved alongside the collection so restarts skip re-tokenizing
+        self.bm25_path = os.path.join(db_path, self.BM25_FILE)
+        self._load_bm25()
+        # Set by _ensure_inner_product when stored chunks were dropped and must be re-indexed
+        self.needs_full_reindex = False
+        self._ensure_inner_product()
     
-    def store_chunks(self, chunks: List[Dict]):
-        """Store all chunks in the vector database"""
+    def _get_collection(self):
+        """Open the chunk collection, creating it with an inner-product index if missing"""
+        return self.client.get_or_create_collection(
+            name=self.COLLECTION_NAME,
+            metadata={"hnsw:space": "ip"}
+        )
+    
+    def _distance_space(self) -> str:
+        """Report the distance function the collection's HNSW index actually uses"""
+        try:
+            return self.collection.configuration_json['hnsw']['space']
+        except (AttributeError, KeyError, TypeError):
+            return (self.collection.metadata or {}).get('hnsw:space', 'l2')
+    
+    def _ensure_inner_product(self):
+        """Recreate a collection built with another distance, since search scores assume inner product"""
+        # Chroma ignores the requested space for a collection that already exists
+        space = self._distance_space()
+        if space == 'ip':
+            return
+        
+        logger.warning(f"Collection uses '{space}' distance instead of 'ip'; recreating it, a full reindex is required")
+        self.client.delete_collection(self.COLLECTION_NAME)
+        self.collection = self._get_collection()
+        
+        # The keyword index must not keep chunks the vector index no longer has
+        self.chunk_documents = []
+        self.chunk_metadatas = []
+        self.tokenized_docs = []
+        self._bm25_positions = {}
+        self._file_chunk_ids = {}
+        self._tombstones = set()
+        self._bm25_dirty = True
+        self.needs_full_reindex = True
+    
+    def store_chunks(self, chunks: Iterable[Dict]):
+        """Store a batch of chunks in the vector database"""
         embeddings = []
         documents = []
         metadatas = []
@@ -43,88 +125,218 @@ class AndroidVectorDB:
             metadatas.append(metadata)
             ids.append(chunk.get('chunk_id', ''))
         
-        # Store in vector DB
+        # Embeddings arrive as float16 and are widened only here, since the HNSW
+        # index stores float32. Normalizing once at ingest lets search use a plain
+        # inner product; upsert overwrites any chunk that is stored again under its ID
         if embeddings:
-            self.collection.add(
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
+            matrix = _unit_rows(np.stack(embeddings).astype(np.float32))
+            # A batch can overshoot STORE_BATCH_SIZE by a file's chunks, so split it
+            # into writes Chroma accepts
+            for begin in range(0, len(ids), self._max_batch_size):
+                end = begin + self._max_batch_size
+                self.collection.upsert(
+                    embeddings=matrix[begin:end],
+                    documents=documents[begin:end],
+                    metadatas=metadatas[begin:end],
+                    ids=ids[begin:end]
+                )
+        
+        # Tokenize only this batch, replacing earlier versions by ID; BM25 is rebuilt lazily
+        for document, metadata in zip(documents, metadatas):
+            tokens = _tokenize(document)
+            position = self._bm25_positions.get(metadata['chunk_id'])
+            if position is None:
+                self._bm25_positions[metadata['chunk_id']] = len(self.chunk_documents)
+                self._file_chunk_ids.setdefault(metadata['file_path'], set()).add(metadata['chunk_id'])
+                self.chunk_documents.append(document)
+                self.chunk_metadatas.append(metadata)
+                self.tokenized_docs.append(tokens)
+            else:
+                self.chunk_documents[position] = document
+                self.chunk_metadatas[position] = metadata
+                self.tokenized_docs[position] = tokens
+        if documents:
+            self._bm25_dirty = True
+    
+    def delete_files(self, file_paths: List[str]):
+        """Remove every stored chunk of the given files before they are stored again"""
+        if not file_paths:
+            return
+        self.collection.delete(where={'file_path': {'$in': list(file_paths)}})
+        
+        # Tombstone the files' BM25 entries; build_bm25 compacts the lists once
+        for file_path in file_paths:
+            for chunk_id in self._file_chunk_ids.pop(file_path, ()):
+                self._tombstones.add(self._bm25_positions.pop(chunk_id))
+                self._bm25_dirty = True
+    
+    def _compact_bm25(self):
+        """Drop tombstoned entries from the BM25 lists, keeping everything else in order"""
+        keep = [
+            position for position in range(len(self.chunk_documents))
+            if position not in self._tombstones
+        ]
+        self.chunk_documents = [self.chunk_documents[position] for position in keep]
+        self.chunk_metadatas = [self.chunk_metadatas[position] for position in keep]
+        self.tokenized_docs = [self.tokenized_docs[position] for position in keep]
+        self._tombstones = set()
+        self._index_positions()
+    
+    def _index_positions(self):
+        """Map each stored chunk ID to its position in the BM25 lists, and each file to its chunk IDs"""
+        self._bm25_positions = {}
+        self._file_chunk_ids = {}
+        for position, metadata in enumerate(self.chunk_metadatas):
+            self._bm25_positions[metadata['chunk_id']] = position
+            self._file_chunk_ids.setdefault(metadata['file_path'], set()).add(metadata['chunk_id'])
+    
+    def build_bm25(self):
+        """Build the BM25 index over everything stored so far and save it"""
+        self._bm25_dirty = False
+        if self._tombstones:
+            self._compact_bm25()
+        # An emptied corpus must clear the old index too, or deleted chunks stay searchable
+        self.bm25_index = BM25Okapi(self.tokenized_docs) if self.tokenized_docs else None
+        self._snapshot_bm25()
+        self._save_bm25()
+    
+    def build_bm25_if_dirty(self):
+        """Rebuild and save the BM25 index only if stored chunks changed since the last build"""
+        if self._bm25_dirty:
+            self.build_bm25()
+    
+    def _snapshot_bm25(self):
+        """Refresh the object arrays aligned with the BM25 index"""
+        self._bm25_documents = np.array(self.chunk_documents, dtype=object)
+        self._bm25_metadatas = np.empty(len(self.chunk_metadatas), dtype=object)
+        self._bm25_metadatas[:] = self.chunk_metadatas
+    
+    def _save_bm25(self):
+        """Pickle the corpus and the built index, including its idf tables"""
+        state = {
+            'tokenizer_version': self.TOKENIZER_VERSION,
+            'documents': self.chunk_documents,
+            'metadatas': self.chunk_metadatas,
+            'tokenized_docs': self.tokenized_docs,
+            'bm25_index': self.bm25_index
+        }
+        tmp_file = f"{self.bm25_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.bm25_path)
+        except Exception as e:
+            logger.error(f"Error saving BM25 index: {str(e)}")
+    
+    def _load_bm25(self):
+        """Restore the keyword index saved by the last build, if any"""
+        try:
+            with open(self.bm25_path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable BM25 index: {str(e)}")
+            return
         
-        # Update BM25 index
-        self.chunk_documents.extend(documents)
-        self.chunk_metadatas.extend(metadatas)
-        tokenized_docs = [doc.split() for doc in self.chunk_documents]
-        self.bm25_index = BM25Okapi(tokenized_docs)
+        self.chunk_documents = state['documents']
+        self.chunk_metadatas = state['metadatas']
+        self._index_positions()
+        if state.get('tokenizer_version') == self.TOKENIZER_VERSION:
+            self.tokenized_docs = state['tokenized_docs']
+            self.bm25_index = state['bm25_index']
+            self._snapshot_bm25()
+        else:
+            # Saved with an older tokenizer: re-tokenize and rebuild on first search
+            self.tokenized_docs = [_tokenize(document) for document in self.chunk_documents]
+            self._bm25_dirty = bool(self.tokenized_docs)
     
     def hybrid_search(self, query: str, n_results: int = 10) -> List[Dict]:
         """Perform hybrid search (vector + keyword)"""
         # Vector search
-        vector_results = self.collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
+        if self.embedding_generator is not None:
+            query_embedding = self.embedding_generator.generate_query_embedding(query)
+            vector_results = self.collection.query(
+                query_embeddings=_unit_rows(query_embedding.reshape(1, -1)),
+                n_results=n_results
+            )
+        else:
+            vector_results = self.collection.query(
+                query_texts=[query],
+                n_results=n_results
+            )
         
-        # BM25 keyword search
-        bm25_results = self._bm25_search(query, n_results)
+        # BM25 keyword search, tokenizing the query once
+        bm25_results = self._bm25_search(_tokenize(query), n_results)
         
         # Combine results
         return self._combine_results(vector_results, bm25_results, n_results)
     
-    def _bm25_search(self, query: str, n_results: int) -> List[Dict]:
+    def _bm25_search(self, tokenized_query: List[str], n_results: int) -> List[Dict]:
         """Perform BM25 keyword search"""
+        self.build_bm25_if_dirty()
         if not self.bm25_index:
             return []
         
-        tokenized_query = query.split()
         scores = self.bm25_index.get_scores(tokenized_query)
-        top_indices = np.argsort(scores)[::-1][:n_results]
+        n_results = min(n_results, len(scores))
+        if n_results <= 0:
+            return []
         
-        results = []
-        for idx in top_indices:
-            if idx < len(self.chunk_metadatas):
-                results.append({
-                    'id': str(idx),
-                    'document': self.chunk_documents[idx],
-                    'metadata': self.chunk_metadatas[idx],
-                    'score': scores[idx]
-                })
+        # O(N) partition for the top k, then sort only those k
+        top_indices = np.argpartition(-scores, n_results - 1)[:n_results]
+        top_indices = top_indices[np.argsort(-scores[top_indices])]
         
-        return results
+        return [
+            {
+                'id': metadata['chunk_id'],
+                'document': document,
+                'metadata': metadata,
+                'score': score
+            }
+            for document, metadata, score in zip(
+                self._bm25_documents[top_indices],
+                self._bm25_metadatas[top_indices],
+                scores[top_indices]
+            )
+        ]
     
     def _combine_results(self, vector_results: Dict, bm25_results: List[Dict], n_results: int) -> List[Dict]:
         """Combine vector and keyword search results"""
-        combined = []
-        
-        # Add vector results
+        # Vector results
+        vector_candidates = ()
         if vector_results['ids']:
-            for i in range(len(vector_results['ids'][0])):
-                combined.append({
-                    'id': vector_results['ids'][0][i],
-                    'document': vector_results['documents'][0][i],
-                    'metadata': vector_results['metadatas'][0][i],
-                    'score': 1 - vector_results['distances'][0][i]  # Convert distance to similarity
-                })
+            vector_candidates = (
+                {
+                    'id': chunk_id,
+                    'document': document,
+                    'metadata': metadata,
+                    'score': 1 - distance  # Convert distance to similarity
+                }
+                for chunk_id, document, metadata, distance in zip(
+                    vector_results['ids'][0],
+                    vector_results['documents'][0],
+                    vector_results['metadatas'][0],
+                    vector_results['distances'][0]
+                )
+            )
         
-        # Add BM25 results
-        for result in bm25_results:
-            # Normalize BM25 score to 0-1 range
-            normalized_score = min(1.0, result['score'] / 10)
-            combined.append({
+        # BM25 results, with scores normalized to the 0-1 range
+        bm25_candidates = (
+            {
                 'id': result['id'],
                 'document': result['document'],
                 'metadata': result['metadata'],
-                'score': normalized_score
-            })
+                'score': min(1.0, result['score'] / 10)
+            }
+            for result in bm25_results
+        )
         
-        # Deduplicate and sort
-        seen = set()
-        deduped = []
-        for item in combined:
-            if item['id'] not in seen:
-                seen.add(item['id'])
-                deduped.append(item)
+        # Deduplicate by keeping each chunk's highest score, then sort once
+        best = {}
+        for candidate in chain(vector_candidates, bm25_candidates):
+            current = best.get(candidate['id'])
+            if current is None or candidate['score'] > current['score']:
+                best[candidate['id']] = candidate
         
-        sorted_results = sorted(deduped, key=lambda x: x['score'], reverse=True)
-        return sorted_results[:n_results]
\ No newline at end of file
+        return sorted(best.values(), key=itemgetter('score'), reverse=True)[:n_results]
@@ -1,41 +1,66 @@
 # android_code_ai/xml_analyzer.py
+import io
 import re
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+from xml.parsers import expat
+
+ANDROID_NAME = '{http://schemas.android.com/apk/res/android}name'
+
+# An element's start tag; quoted attribute values may contain '>'
+START_TAG_RE = re.compile(rb'<[^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*>')
+
+def read_manifest(source: Union[str, Path, BinaryIO]) -> Tuple[List[str], Optional[Dict[str, str]]]:
+    """Stream an AndroidManifest.xml path or file object into its permission names and application attributes"""
+    permissions = []
+    application_attrib = None
+    depth = 0
+    # Free each element once it has been handled
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            # Application attributes are complete on its start tag
+            if depth == 1 and elem.tag == 'application':
+                application_attrib = dict(elem.attrib)
+            depth += 1
+            continue
+        
+        depth -= 1
+        if elem.tag == 'uses-permission':
+            android_name = elem.get(ANDROID_NAME)
+            if android_name:
+                permissions.append(android_name)
+        elem.clear()
+    return permissions, application_attrib
 
 class XMLAnalyzer:
     MAX_CHUNK_SIZE = 2000
     MIN_CHUNK_SIZE = 500
     
-    def analyze_file(self, file_path: str, content: str) -> List[Dict]:
+    def analyze_file(self, file_path: str, content: str, code_bytes: Optional[bytes] = None) -> List[Dict]:
         """Analyze XML file and extract chunks"""
         chunks = []
+        if code_bytes is None:
+            code_bytes = content.encode('utf-8')
         
         try:
             if file_path.endswith('AndroidManifest.xml'):
-                chunks.extend(self._analyze_manifest(content, file_path))
+                chunks.extend(self._analyze_manifest(code_bytes, file_path))
             else:
                 # Assume it's a layout XML
-                chunks.extend(self._analyze_layout(content, file_path))
-        except ET.ParseError:
-            # Fallback to regex-based analysis
+                chunks.extend(self._analyze_layout(code_bytes, file_path))
+        except (ET.ParseError, expat.ExpatError):
+            # Fallback to scan-based analysis
             return self._chunk_with_regex(content, file_path)
         
         return chunks
     
-    def _analyze_manifest(self, content: str, file_path: str) -> List[Dict]:
+    def _analyze_manifest(self, code_bytes: bytes, file_path: str) -> List[Dict]:
         """Analyze AndroidManifest.xml"""
         chunks = []
-        root = ET.fromstring(content)
+        permissions, application_attrib = read_manifest(io.BytesIO(code_bytes))
         
         # Chunk permissions
-        permissions = []
-        for perm in root.findall('.//uses-permission'):
-            android_name = perm.get('{http://schemas.android.com/apk/res/android}name')
-            if android_name:
-                permissions.append(android_name)
-        
         if permissions:
             chunks.append({
                 'type': 'manifest_permissions',
@@ -44,28 +69,22 @@ class XMLAnalyzer:
             })
         
         # Chunk application info
-        application = root.find('application')
-        if application is not None:
-            app_info = []
-            for attr in application.attrib:
-                app_info.append(f"{attr}: {application.attrib[attr]}")
-            
+        if application_attrib is not None:
             chunks.append({
                 'type': 'manifest_application',
-                'content': '\n'.join(app_info),
+                'content': '\n'.join(f"{attr}: {value}" for attr, value in application_attrib.items()),
                 'file_path': file_path
             })
         
         return chunks
     
-    def _analyze_layout(self, content: str, file_path: str) -> List[Dict]:
+    def _analyze_layout(self, code_bytes: bytes, file_path: str) -> List[Dict]:
         """Analyze layout XML file"""
         chunks = []
-        root = ET.fromstring(content)
         
-        # Extract top-level elements
-        for child in root:
-            element_xml = ET.tostring(child, encoding='unicode')
+        # Extract top-level elements as slices of the original source
+        for start, end in self._top_level_spans(code_bytes):
+            element_xml = code_bytes[start:end].decode('utf-8')
             if len(element_xml) > self.MAX_CHUNK_SIZE:
                 # Split large elements
                 chunks.extend(self._split_xml_element(element_xml, file_path))
@@ -78,40 +97,76 @@ class XMLAnalyzer:
         
         return chunks
     
+    def _top_level_spans(self, code_bytes: bytes) -> List[Tuple[int, int]]:
+        """Byte ranges of the root's child elements, found without building a tree"""
+        spans = []
+        depth = 0
+        start = tag_end = 0
+        parser = expat.ParserCreate()
+        
+        def start_element(name, attrs):
+            nonlocal depth, start, tag_end
+            depth += 1
+            if depth == 2:
+                start = parser.CurrentByteIndex
+                tag_match = START_TAG_RE.match(code_bytes, start)
+                if tag_match is None:
+                    # Elements expanded from an entity have no start tag of their own
+                    # in the source; let the scan-based fallback chunk the file instead
+                    raise expat.ExpatError("element has no start tag in the source")
+                tag_end = tag_match.end()
+        
+        def end_element(name):
+            nonlocal depth
+            if depth == 2:
+                if code_bytes[tag_end - 2:tag_end] == b'/>':
+                    # Empty element: the start tag is the whole element
+                    spans.append((start, tag_end))
+                else:
+                    spans.append((start, code_bytes.index(b'>', parser.CurrentByteIndex) + 1))
+            depth -= 1
+        
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.Parse(code_bytes, True)
+        return spans
+    
     def _split_xml_element(self, element_xml: str, file_path: str) -> List[Dict]:
         """Split large XML elements into chunks"""
         chunks = []
-        current_chunk = ""
         
-        # Split by child elements or attributes
+        # Split by child elements or attributes; track the running size instead of
+        # growing a string, and join each chunk's lines once
         lines = element_xml.split('\n')
-        for line in lines:
-            if len(current_chunk) + len(line) > self.MAX_CHUNK_SIZE and current_chunk:
+        start = 0
+        size = 0
+        for i, line in enumerate(lines):
+            if size + len(line) > self.MAX_CHUNK_SIZE and size:
                 chunks.append({
                     'type': 'layout_element_chunk',
-                    'content': current_chunk.strip(),
+                    'content': '\n'.join(lines[start:i]).strip(),
                     'file_path': file_path,
                 })
-                current_chunk = ""
-            current_chunk += line + '\n'
+                start = i
+                size = 0
+            size += len(line) + 1
         
-        if current_chunk.strip():
+        remainder = '\n'.join(lines[start:]).strip()
+        if remainder:
             chunks.append({
                 'type': 'layout_element_chunk',
-                'content': current_chunk.strip(),
+                'content': remainder,
                 'file_path': file_path,
             })
         
         return chunks
     
     def _chunk_with_regex(self, content: str, file_path: str) -> List[Dict]:
-        """Fallback XML parsing with regex"""
+        """Fallback XML parsing with a linear tag scan"""
         chunks = []
-        current_chunk = ""
         
         # Split by top-level elements
-        elements = re.findall(r'<([a-zA-Z][a-zA-Z0-9]*)(?:\s[^>]*)?>.*?</\1>', content, re.DOTALL)
-        for element in elements:
+        for element in self._scan_elements(content):
             if len(element) > self.MAX_CHUNK_SIZE:
                 # Split large elements
                 chunks.extend(self._split_xml_element(element, file_path))
@@ -122,4 +177,53 @@ class XMLAnalyzer:
                     'file_path': file_path
                 })
         
-        return chunks
\ No newline at end of file
+        return chunks
+    
+    def _scan_elements(self, content: str) -> Iterator[str]:
+        """Yield top-level elements in one pass, tolerating unbalanced and unclosed tags"""
+        # Only tags named like the open top-level element affect nesting
+        root_tag = None
+        depth = 0
+        start = 0
+        pos = 0
+        while True:
+            open_pos = content.find('<', pos)
+            if open_pos == -1:
+                break
+            # Comments may contain '>' so skip to their terminator
+            if content.startswith('<!--', open_pos):
+                comment_end = content.find('-->', open_pos + 4)
+                if comment_end == -1:
+                    break
+                pos = comment_end + 3
+                continue
+            close_pos = content.find('>', open_pos + 1)
+            if close_pos == -1:
+                break
+            pos = close_pos + 1
+            
+            tag = content[open_pos + 1:close_pos].split(None, 1)
+            if not tag or (not tag[0][0].isalpha() and tag[0][0] != '/'):
+                # Declarations and processing instructions
+                continue
+            name = tag[0].rstrip('/')
+            if name.startswith('/'):
+                if name[1:] == root_tag:
+                    depth -= 1
+                    if not depth:
+                        root_tag = None
+                        yield content[start:pos]
+            elif content[close_pos - 1] == '/':
+                # Self-closing element
+                if root_tag is None:
+                    yield content[open_pos:pos]
+            elif root_tag is None:
+                root_tag = name
+                depth = 1
+                start = open_pos
+            elif name == root_tag:
+                depth += 1
+        
+        # A truncated file never closes its element, so keep everything from its start
+        if root_tag is not None:
+            yield content[start:].rstrip()